@@ -1,5 +1,4 @@
 # chunk basic so that more multiple tasks can then be run as opposed to megafiles!
-import bz2
 from pathlib import Path
 import sys, os, shutil
 
@@ -7,7 +6,7 @@ WORKINGDIR = '/opt/xchem-fragalysis-2/mferla/library_making'
 
 sys.path.append(f'{WORKINGDIR}/repo/library_subsetting_module')
 
-from library_subsetting_module import ParallelChunker, SieveMode, sieve_chunk
+from library_subsetting_module import ParallelChunker, SieveMode, sieve_chunk, concatenate_bz2, SIEVE_CHUNK_HEADERS
 
 path = Path(sys.argv[1])
 assert path.exists(), f'{path} does not exists'
@@ -18,19 +17,13 @@ df = master.process_file(filename=path.as_posix(),
                          out_filename_template=out_filename_template,
                         summary_cache='second_pass_summary.jsonl',
                         mode=SieveMode.substructure,
+                        write_header=False,
+                        smiles_parser_threads=2,
+                        row_threads=2,
                         )
 out_filename_template=f'{WORKINGDIR}/second_pass/{path.name}' # same name, diff folder
-header_added = False
-with bz2.open(out_filename_template, 'wt') as out_fh:
-    for chunk_path in Path('/tmp/second_pass').glob('*.bz2'):
-        with bz2.open(chunk_path, 'rt') as in_fh:
-            # skip first line (header)
-            if not header_added:
-                header = next(in_fh)
-                out_fh.write(header)
-                header_added = True
-            for line in in_fh:
-                out_fh.write(line)
+# the chunks are headerless bz2 files, which are concatenated byte-wise
+concatenate_bz2(Path('/tmp/second_pass').glob('*.bz2'), out_filename_template, header='\t'.join(SIEVE_CHUNK_HEADERS))
 
 shutil.rmtree('/tmp/second_pass')
 print(path, len(df))
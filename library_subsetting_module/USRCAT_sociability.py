@@ -45,4 +45,30 @@ def calc_usrscores(d1: torch.Tensor, d2_matrix: torch.Tensor) -> torch.Tensor:
 
 def calc_summed_scores(d1: torch.Tensor, d2_matrix: torch.Tensor, d2_weights: torch.Tensor, cutoff=0.7) -> torch.Tensor:
     scores = calc_usrscores(d1, d2_matrix)  # Shape: (num_rows)
-    return d2_weights[scores > cutoff].sum()  # Shape: 1
\ No newline at end of file
+    return d2_weights[scores > cutoff].sum()  # Shape: 1
+
+def calc_usrscores_batch(d1_matrix: torch.Tensor, d2_matrix: torch.Tensor) -> torch.Tensor:
+    """
+    Batched version of ``calc_usrscores``: all the queries in ``d1_matrix`` are scored against ``d2_matrix``
+    in one go (one ``torch.cdist`` call as opposed to one call per query).
+    The L1 distance over a chunk of 12 divided by 12 is the mean absolute difference of ``calc_usrscores``.
+    """
+    num = 12  # length of each subset
+    d1_chunks = d1_matrix.view(d1_matrix.size(0), -1, num).transpose(0, 1)  # Shape: (num_chunks, num_queries, 12)
+    d2_chunks = d2_matrix.view(d2_matrix.size(0), -1, num).transpose(0, 1)  # Shape: (num_chunks, num_rows, 12)
+    protoscores = torch.cdist(d1_chunks, d2_chunks, p=1).sum(dim=0) / num  # Shape: (num_queries, num_rows)
+    return 1.0 / (1.0 + protoscores)  # Shape: (num_queries, num_rows)
+
+
+def calc_summed_scores_batch(d1_matrix: torch.Tensor,
+                             d2_matrix: torch.Tensor,
+                             d2_weights: torch.Tensor,
+                             cutoff=0.7,
+                             batch_size=1024) -> torch.Tensor:
+    """
+    Batched version of ``calc_summed_scores``.
+    The queries are done in batches of ``batch_size`` to cap the (batch_size, num_rows) score matrix in memory.
+    """
+    summed = [((calc_usrscores_batch(d1_batch, d2_matrix) > cutoff) * d2_weights).sum(dim=1)
+              for d1_batch in torch.split(d1_matrix, batch_size)]
+    return torch.cat(summed)  # Shape: (num_queries)
@@ -2,8 +2,8 @@ from .parallel import ParallelChunker
 from .compound_sieve import CompoundSieve, SieveMode, BadCompound
 from .restrictive_decomposition import RestrictiveDecomposer, InchiType, RxnDetails
 from .dataset2dataframe import DatasetConverter
-from .util import read_jsonl, write_jsonl
-from .process_tasks import sieve_chunk, test_process_chunk, sieve_chunk2
+from .util import read_jsonl, write_jsonl, concatenate_bz2
+from .process_tasks import sieve_chunk, test_process_chunk, sieve_chunk2, SIEVE_CHUNK_HEADERS, SIEVE_CHUNK2_HEADERS
 from .pipiteur import Pipiteur, PIPType
 from . import data
 from .archive import *
\ No newline at end of file
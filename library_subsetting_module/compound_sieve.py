@@ -3,27 +3,33 @@ __all__ = ['InchiType', 'BadCompound', 'SieveMode', 'CompoundSieve']
 import io
 import enum
 import itertools
+import functools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Optional, NewType, Callable, Tuple
+from typing import List, Dict, Optional, NewType, Callable, Tuple, Union, NamedTuple
 
 import numpy as np
 import pandas as pd
 from rdkit import Chem, rdBase
 from rdkit.Chem import rdMolDescriptors, AllChem, rdDeprotect
-from rdkit.Chem import FilterCatalog, rdfiltercatalog
+from rdkit.Chem import FilterCatalog, rdfiltercatalog, rdmolfiles
 
 from .pipiteur import Pipiteur
 from . import data
 
 try:
     import torch
-    from .USRCAT_sociability import calc_summed_scores
+    from .USRCAT_sociability import calc_summed_scores, calc_summed_scores_batch
 except ImportError:
     torch = None
     calc_summed_scores = None
+    calc_summed_scores_batch = None
 from .restrictive_decomposition import RestrictiveDecomposer
 
 InchiType = NewType('InchiType', str)
+# a row of the dataframe, either as a pd.Series (``df.apply``) or a namedtuple (``df.itertuples``)
+RowType = Union[pd.Series, NamedTuple]
 
 # pains
 pains_catalogue_params = rdfiltercatalog.FilterCatalogParams()
@@ -92,6 +98,8 @@ class CompoundSieve:
     """
 
     dps = rdDeprotect.GetDeprotections()
+    # the reactant side of the deprotections, see ``_has_protection``
+    protection_patterns: List[Chem.Mol] = [Chem.MolFromSmarts(dp.reaction_smarts.split('>>')[0]) for dp in dps]
     # this could be written as a FilterCatalog
     unwanted = {'exocyclic carbamate': Chem.MolFromSmarts('[N!R]-C(=O)-O'),
                 'exocyclic ester': Chem.MolFromSmarts('[C!R](=O)-[OH0!R]'),
@@ -136,6 +144,18 @@ class CompoundSieve:
                    )
 
     exception_to_catch = (Exception,    )
+    # number of threads for ``MultithreadedSmilesMolSupplier`` in ``classify_df`` (0 = ``Chem.MolFromSmiles`` per row)
+    # the sieve tasks set it per classifier (``smiles_parser_threads`` argument), the passes use 2
+    smiles_parser_threads = 0
+    # number of threads for the per row classification in ``classify_df`` (1 = no thread pool)
+    # RDKit's C++ matching releases the GIL, capped at 2 as the ParallelChunker workers already use the cores.
+    # The sieve tasks set it per classifier (``row_threads`` argument), the passes use 2.
+    # The v2 caches (``nuveau_dejavu_synthons`` etc.) are plain dicts: a race merely calculates the same synthon twice
+    row_threads = 1
+    # see ``enable_analysis_mode``
+    analysis_mode = False
+    # the columns used by ``calc_row_info``
+    row_info_columns = ('HBonds', 'HAC', 'Rotatable_Bonds', 'MW')
 
     # PAINS
     pains_catalog = rdfiltercatalog.FilterCatalog(pains_catalogue_params)
@@ -157,6 +177,9 @@ class CompoundSieve:
             self.common_synthons_usrcats = torch.tensor(common_synthons_usrcats, device='cuda')
             self.dejavu_synthons: Dict[InchiType, int] = {}
             self.nuveau_dejavu_synthons: Dict[InchiType, int] = {}
+            # see ``classify_batch``
+            self.defer_sociability = False
+            self.pending_synthons: Dict[InchiType, Chem.Mol] = {}
             self.robodecomposer = RestrictiveDecomposer()
         elif self.mode == SieveMode.synthon:
             self.screening_catalog = self.get_screening_library_catalog(screening_filename)
@@ -182,8 +205,10 @@ class CompoundSieve:
     def enable_analysis_mode(self):
         """
         The cutoffs are disabled, so the values are all run...
+        The unwanted groups still fail a compound, but after ``calc_boringness`` as opposed to before it.
         """
         self.cutoffs = {k: {'min': 0, 'max': float('inf')}[k[:3]] for k, v in self.cutoffs.items()}
+        self.analysis_mode = True
 
     def classify_df(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -192,38 +217,116 @@ class CompoundSieve:
         :param df:
         :return:
         """
+        # ## Basic row info based, vectorised
+        # the rows failing the row info cutoffs do not go through the per row classification
+        positions = np.arange(len(df))
+        if self.use_row_info:
+            row_info: Dict[str, np.ndarray] = self.calc_row_info_df(df)
+            mw: np.ndarray = row_info.pop('MW')
+            issues: np.ndarray = self.assess_df(row_info)
+            # the issues ``calc_row_info`` would raise for a zero denominator
+            issues[mw == 0] = 'Uncaught ZeroDivisionError exception: float division by zero'
+            issues[row_info['HAC'] == 0] = 'Uncaught ZeroDivisionError exception: division by zero'
+            rejected: np.ndarray = issues != ''
+            kept = ~rejected
+            row_infos = [dict(zip(row_info, values))
+                         for values in zip(*[values[kept].tolist() for values in row_info.values()])]
+        else:
+            row_info = {}
+            issues = np.full(len(df), '', dtype=object)
+            rejected = np.zeros(len(df), dtype=bool)
+            kept = ~rejected
+            row_infos = [None] * len(df)
+        # ## Per row
+        # the columns are pulled out as plain lists as opposed to making a pd.Series or a namedtuple per row
+        identifiers: List[str] = df.Identifier.to_numpy(dtype=object)[kept].tolist()
+        smiles_list: List[str] = df.SMILES.to_numpy(dtype=object)[kept].tolist()
         with rdBase.BlockLogs():
-            _verdicts: pd.Series = df.apply(self, axis=1)
-        verdicts: pd.DataFrame = pd.DataFrame(_verdicts.tolist(), index=_verdicts.index)
+            if 'mol' in df.columns:
+                mols = df.mol.to_numpy(dtype=object)[kept].tolist()
+            elif self.smiles_parser_threads and self.mode != SieveMode.basic:
+                mols = self.parse_smiles(smiles_list)
+            else:
+                mols = [None] * len(smiles_list)
+            # the combined Z-score is calculated across the chunk unless needed for the sdfblock
+            defer_score: bool = self.mode == SieveMode.synthon and not self.store_sdf
+            # the arguments of ``_call_row`` in order
+            call_row = functools.partial(self._call_row, defer_score=defer_score)
+            row_args = (identifiers, smiles_list, row_infos, mols)
+            if self.row_threads > 1:
+                with ThreadPoolExecutor(max_workers=self.row_threads) as executor:
+                    records: List[dict] = list(executor.map(call_row, *row_args))
+            else:
+                records: List[dict] = list(map(call_row, *row_args))
+        verdicts: pd.DataFrame = pd.DataFrame.from_records(records, index=positions[kept])
+        if rejected.any():
+            rejected_verdicts = pd.DataFrame({'acceptable': False,
+                                              'issue': issues[rejected],
+                                              'Identifier': df.Identifier.to_numpy()[rejected],
+                                              'SMILES': df.SMILES.to_numpy()[rejected],
+                                              **{key: values[rejected] for key, values in row_info.items()}},
+                                             index=positions[rejected])
+            verdicts = pd.concat([verdicts, rejected_verdicts]).sort_index()
+        verdicts.index = df.index
+        if defer_score:
+            self.calc_score_df(verdicts, verdicts.acceptable.to_numpy(dtype=bool))
         print(f'{round(verdicts.acceptable.value_counts().to_dict().get(True, 0) / len(verdicts) * 100)}% accepted')
         return verdicts
 
-    def __call__(self, row: pd.Series):
+    def __call__(self, row: RowType) -> dict:
+        """
+        The row can be a pd.Series or a namedtuple as only attribute access is used.
+        """
+        row_values = tuple(getattr(row, column) for column in self.row_info_columns) if self.use_row_info else None
+        return self._call_row(row.Identifier, row.SMILES, row_values=row_values, mol=getattr(row, 'mol', None))
+
+    def _call_row(self,
+                  identifier: str,
+                  smiles: str,
+                  row_info: Optional[dict] = None,
+                  mol: Optional[Chem.Mol] = None,
+                  row_values: Optional[tuple] = None,
+                  defer_score: bool = False) -> dict:
+        """
+        The classification of a single compound from plain values.
+        ``row_info`` is the row info precalculated by ``calc_row_info_df`` (``classify_df``), if any.
+        ``mol`` is the molecule if already parsed.
+        ``row_values`` are the values of ``row_info_columns`` for ``calc_row_info`` (``__call__``), if any.
+        ``defer_score`` skips ``calc_score`` as ``calc_score_df`` will be called on the verdicts.
+        """
         verdict = {'acceptable': False, 'issue': '',
-                   'Identifier': row.Identifier,
-                   'SMILES': row.SMILES}
-        if row.SMILES == 'SMILES':
+                   'Identifier': identifier,
+                   'SMILES': smiles}
+        if smiles == 'SMILES':
             verdict['issue'] = 'rogue header'
             return verdict
         try:
             # ## Basic row info based
-            if self.use_row_info:
-                self.calc_row_info(row, verdict)
+            if row_info is not None:
+                verdict.update(row_info)
+            elif row_values is not None:
+                self.calc_row_info(row_values, verdict)
             self.assess(verdict)
             if self.mode == SieveMode.basic:
                 verdict['acceptable'] = True
                 return verdict
             # ## Mol based
-            if 'mol' not in row.index:
-                mol = Chem.MolFromSmiles(row.SMILES)
-            else:
-                mol = row.mol
+            if mol is None:
+                mol = Chem.MolFromSmiles(smiles)
             verdict['SMILES'] = Chem.MolToSmiles(mol)
-            self.calc_mol_info(mol, verdict)
+            # ordered by cost: cheap & selective first, PAINS last
+            # bar in analysis mode, wherein the boringness is calculated for the compounds with unwanted groups too
+            # the SSSR is perceived when sanitising, so the rings are shared across the descriptors
+            atom_rings: Tuple[Tuple[int, ...], ...] = mol.GetRingInfo().AtomRings()
+            self.calc_mol_info(mol, verdict, atom_rings=atom_rings)
             self.assess(verdict)
-            self.calc_boringness(mol, verdict)
+            if not self.analysis_mode:
+                self._check_unwanted(mol, verdict)
+            self.calc_boringness(mol, verdict, atom_rings=atom_rings)
             self.assess(verdict)
-            self.assess_mol_patterns(mol, verdict)
+            if self.analysis_mode:
+                self._check_unwanted(mol, verdict)
+            self._check_pains(mol, verdict)
             if self.mode == SieveMode.substructure:
                 verdict['acceptable'] = True
                 return verdict
@@ -241,9 +344,10 @@ class CompoundSieve:
                     mol = AllChem.AddHs(mol)
                     AllChem.EmbedMolecule(mol)
                 self.calc_pip(mol, verdict)
-                self.calc_score(mol, verdict)
+                if not defer_score:
+                    self.calc_score(mol, verdict)
                 if self.store_sdf:
-                    verdict['sdfblock'] = self.mol2sdf(mol, row, verdict)
+                    verdict['sdfblock'] = self.mol2sdf(mol, identifier, smiles, verdict)
         except BadCompound as e:
             verdict['issue'] = str(e)
             return verdict
@@ -256,12 +360,55 @@ class CompoundSieve:
             verdict['acceptable'] = True
             return verdict
 
-    def calc_row_info(self, row: pd.Series, verdict: dict):
-        verdict['hbonds'] = int(row.HBonds)
-        verdict['HAC'] = int(row.HAC)
-        verdict['hbonds_per_HAC'] = int(row.HBonds) / int(row.HAC)
-        verdict['rota_per_da'] = int(row.Rotatable_Bonds) / row.MW
-        verdict['rota_per_HAC'] = int(row.Rotatable_Bonds) / int(row.HAC)
+    def parse_smiles(self, smiles_list: List[str]) -> List[Optional[Chem.Mol]]:
+        """
+        Parses the SMILES with RDKit's ``MultithreadedSmilesMolSupplier`` (``smiles_parser_threads`` threads).
+        The supplier reads from a file and fails on CXSMILES extensions (e.g. ``|&1:1,3|``),
+        so these are not passed to it and are left as None for ``_call_row`` to parse.
+        """
+        mols: List[Optional[Chem.Mol]] = [None] * len(smiles_list)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / 'chunk.smi'
+            with path.open('w') as fh:
+                for i, smiles in enumerate(smiles_list):
+                    if ' ' not in smiles:
+                        fh.write(f'{smiles}\t{i}\n')
+            supplier = rdmolfiles.MultithreadedSmilesMolSupplier(path.as_posix(), delimiter='\t', titleLine=False,
+                                                                 numWriterThreads=self.smiles_parser_threads)
+            for mol in supplier:
+                # the order is not preserved, the name is the index
+                if mol is not None:
+                    mols[int(mol.GetProp('_Name'))] = mol
+            del supplier
+        return mols
+
+    def calc_row_info(self, row_values: tuple, verdict: dict):
+        """
+        ``row_values`` are the values of the columns ``row_info_columns`` of a row.
+        """
+        hbonds, hac, rota, mw = row_values
+        verdict['hbonds'] = int(hbonds)
+        verdict['HAC'] = int(hac)
+        verdict['hbonds_per_HAC'] = int(hbonds) / int(hac)
+        verdict['rota_per_da'] = int(rota) / mw
+        verdict['rota_per_HAC'] = int(rota) / int(hac)
+
+    def calc_row_info_df(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Vectorised version of ``calc_row_info`` for the whole dataframe.
+        The keys are the same as the verdict keys from ``calc_row_info``, plus 'MW'.
+        """
+        hbonds = df.HBonds.to_numpy().astype(int)
+        hac = df.HAC.to_numpy().astype(int)
+        rota = df.Rotatable_Bonds.to_numpy().astype(int)
+        mw = df.MW.to_numpy().astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {'hbonds': hbonds,
+                    'HAC': hac,
+                    'hbonds_per_HAC': hbonds / hac,
+                    'rota_per_da': rota / mw,
+                    'rota_per_HAC': rota / hac,
+                    'MW': mw}
 
     def assess(self, verdict: dict):
         for key in self.cutoffs:
@@ -272,7 +419,23 @@ class CompoundSieve:
             elif key[:3] == 'max' and verdict[key[4:]] > self.cutoffs[key]:
                 raise BadCompound(f'{key[4:]} too high')
 
-    def calc_mol_info(self, mol: Chem.Mol, verdict: dict):
+    def assess_df(self, values: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Vectorised version of ``assess``, which returns the issue of each row ('' if none)
+        as opposed to raising ``BadCompound``.
+        As with ``assess``, the first violated cutoff is the issue.
+        """
+        issues = np.full(len(next(iter(values.values()), [])), '', dtype=object)
+        for key in self.cutoffs:
+            if key[4:] not in values:
+                continue
+            elif key[:3] == 'min':
+                issues[(issues == '') & (values[key[4:]] < self.cutoffs[key])] = f'{key[4:]} too low'
+            elif key[:3] == 'max':
+                issues[(issues == '') & (values[key[4:]] > self.cutoffs[key])] = f'{key[4:]} too high'
+        return issues
+
+    def calc_mol_info(self, mol: Chem.Mol, verdict: dict, atom_rings: Optional[Tuple[Tuple[int, ...], ...]] = None):
         # ## Mol based
         if not self.use_row_info:
             verdict['HAC'] = rdMolDescriptors.CalcNumHeavyAtoms(mol)
@@ -282,48 +445,90 @@ class CompoundSieve:
             verdict['Rotatable_Bonds'] = rdMolDescriptors.CalcNumRotatableBonds(mol)
             verdict['hbonds_per_HAC'] = verdict['hbonds'] / verdict['HAC']
             verdict['rota_per_HAC'] = verdict['Rotatable_Bonds'] / verdict['HAC']
-        verdict['N_rings'] = rdMolDescriptors.CalcNumRings(mol)
-        verdict['N_methylene'] = len(mol.GetSubstructMatches(Chem.MolFromSmarts('[CH2X4!R]')))
-        verdict['N_ring_atoms'] = len(mol.GetSubstructMatches(Chem.MolFromSmarts('[R]')))
-        verdict['largest_ring_size'] = max([0, *map(len, mol.GetRingInfo().AtomRings())])
-        verdict['N_protection_groups'] = rdDeprotect.Deprotect(mol, deprotections=self.dps) \
-            .GetIntProp('DEPROTECTION_COUNT')
+        if atom_rings is None:
+            atom_rings = mol.GetRingInfo().AtomRings()
+        verdict['N_rings'] = len(atom_rings)
+        verdict['N_methylene'], verdict['N_ring_atoms'] = self._atom_pass(mol)
+        verdict['largest_ring_size'] = max([0, *map(len, atom_rings)])
+        # ``Deprotect`` is costly and a single protection group fails the default cutoff of zero
+        if not self._has_protection(mol):
+            verdict['N_protection_groups'] = 0
+        elif self.cutoffs.get('max_N_protection_groups', float('inf')) == 0:
+            verdict['N_protection_groups'] = 1
+        else:
+            verdict['N_protection_groups'] = rdDeprotect.Deprotect(mol, deprotections=self.dps) \
+                .GetIntProp('DEPROTECTION_COUNT')
+
+    def _has_protection(self, mol: Chem.Mol) -> bool:
+        """
+        Does the molecule match any of the deprotection reactant templates?
+        """
+        return any(mol.HasSubstructMatch(pattern) for pattern in self.protection_patterns)
 
     def assess_mol_patterns(self, mol: Chem.Mol, verdict: dict):
         # ## Matching based
+        self._check_unwanted(mol, verdict)
+        self._check_pains(mol, verdict)
+
+    def _check_unwanted(self, mol: Chem.Mol, verdict: dict):
         for name, pattern in self.unwanted.items():
             if Chem.Mol.HasSubstructMatch(mol, pattern):
                 raise BadCompound(f'Contains {name}')
-        if len(self.pains_catalog.GetMatches(mol)):
+
+    def _check_pains(self, mol: Chem.Mol, verdict: dict):
+        # the PAINS catalogue is the most expensive of the pattern checks
+        if self.pains_catalog.HasMatch(mol):
             raise BadCompound('PAINS')
 
-    def calc_n_fused_rings(self, mol):
-        ars = mol.GetRingInfo().AtomRings()
+    @staticmethod
+    def _atom_pass(mol: Chem.Mol) -> Tuple[int, int]:
+        """
+        Counts in a single pass over the atoms
+        the methylenes (SMARTS ``[CH2X4!R]``, i.e. not a methylene radical but a -CH2- group)
+        and the ring atoms (SMARTS ``[R]``).
+        """
+        n_methylene = 0
+        n_ring_atoms = 0
+        for atom in mol.GetAtoms():
+            in_ring: bool = atom.IsInRing()
+            n_ring_atoms += in_ring
+            if not in_ring and atom.GetAtomicNum() == 6 and atom.GetTotalDegree() == 4 \
+                    and atom.GetTotalNumHs(includeNeighbors=True) == 2:
+                n_methylene += 1
+        return n_methylene, n_ring_atoms
+
+    def calc_n_fused_rings(self, mol, atom_rings: Optional[Tuple[Tuple[int, ...], ...]] = None):
+        ars = mol.GetRingInfo().AtomRings() if atom_rings is None else atom_rings
         return sum([len(set(fore).intersection(aft)) > 1 for fore, aft in list(itertools.combinations(ars, 2))])
 
-    def calc_boringness(self, mol: Chem.Mol, verdict: dict):
+    # weights of the counts for ``calc_boringness``: cool is -1, halfcool is -1/2, boring is +1, boringish is +1/4
+    # the weights are multiples of 1/4 so the sum is exact irrespective of order
+    boringness_weights = {'N_spiro': -1.,
+                          'N_bridgehead': -1.,
+                          'N_alicyclics': -1.,
+                          'N_fused_rings': -1.,
+                          'N_heterocyclics': -0.5,
+                          'N_aromatic_carbocycles': +1.,
+                          'N_methylene': +0.25,
+                          }
+
+    def calc_boringness(self, mol: Chem.Mol, verdict: dict, atom_rings: Optional[Tuple[Tuple[int, ...], ...]] = None):
         """
         A big problem is that the top sociable compounds are boring compounds
         Namely, phenyls galore.
+
+        The ring counts are left to ``rdMolDescriptors`` as its C++ loops are faster than a single Python loop over the rings.
         """
         verdict['N_spiro'] = rdMolDescriptors.CalcNumSpiroAtoms(mol)
         verdict['N_bridgehead'] = rdMolDescriptors.CalcNumBridgeheadAtoms(mol)
         # an `AliphaticRings` includes heterocycles.
         verdict['N_alicyclics'] = rdMolDescriptors.CalcNumAliphaticRings(mol)
-        verdict['N_fused_rings'] = self.calc_n_fused_rings(mol)
+        verdict['N_fused_rings'] = self.calc_n_fused_rings(mol, atom_rings)
         verdict['N_heterocyclics'] = rdMolDescriptors.CalcNumHeterocycles(mol)
         verdict['N_aromatic_carbocycles'] = rdMolDescriptors.CalcNumAromaticCarbocycles(mol)
-        # previously calculated: # not a methylene radical but a -CH2- group
-        verdict['N_methylene'] = len(mol.GetSubstructMatches(Chem.MolFromSmarts('[CH2X4!R]')))
+        # verdict['N_methylene'] is previously calculated in ``calc_mol_info``
         # make an arbitrary score of coolness
-        cool_keys = ['N_spiro', 'N_bridgehead', 'N_alicyclics', 'N_fused_rings']
-        # halfcool_keys = ['N_heterocyclics']
-        boring_keys = ['N_aromatic_carbocycles']
-        # boringish_keys = ['N_methylene']
-        verdict['boringness'] = sum(map(verdict.get, boring_keys)) + \
-                                verdict['N_methylene'] / 4 - \
-                                sum(map(verdict.get, cool_keys)) - \
-                                verdict['N_heterocyclics'] / 2
+        verdict['boringness'] = sum([weight * verdict[key] for key, weight in self.boringness_weights.items()])
         verdict['boringness_per_HAC'] = verdict['boringness'] / verdict['HAC']
 
     def calc_synthon_info(self, mol: Chem.Mol, verdict: dict):
@@ -396,6 +601,23 @@ class CompoundSieve:
         wzscorify = lambda k: self.score_weights[k] * (verdict[k] - self.ref_means.get(k, 0)) / self.ref_stds.get(k, 1)
         verdict['combined_Zscore'] = sum([wzscorify(k) for k in self.score_weights]) / (len(self.score_weights) ** 0.5)
 
+    def calc_score_df(self, verdicts: pd.DataFrame, mask: np.ndarray):
+        """
+        Vectorised version of ``calc_score`` for the rows of ``verdicts`` in ``mask``, which is altered in place.
+        """
+        if not mask.any():
+            return
+        keys = list(self.score_weights)
+        hac = verdicts.HAC.to_numpy(dtype=float)[mask]
+        for key in keys:
+            if key not in verdicts.columns:
+                verdicts.loc[mask, key] = verdicts[key.replace('_per_HAC', '')].to_numpy(dtype=float)[mask] / hac
+        features = verdicts[keys].to_numpy(dtype=float)[mask]
+        weights = np.array([self.score_weights[k] for k in keys])
+        means = np.array([self.ref_means.get(k, 0) for k in keys])
+        stds = np.array([self.ref_stds.get(k, 1) for k in keys])
+        verdicts.loc[mask, 'combined_Zscore'] = ((features - means) / stds) @ weights / (len(keys) ** 0.5)
+
     def calc_outtajail_score(self, mol: Chem.Mol, verdict: dict):
         """
         The out-of-jail-card score is a shift of the combined Zscore to boost substructures of XChem screening library
@@ -493,9 +715,9 @@ class CompoundSieve:
         verdict[f'pip_common_rms'] = np.mean(np.power(pip_commons - lower_bound, 2))
         verdict[f'pip_uncommon_rms'] = np.mean(np.power(pip_uncommons - lower_bound, 2))
 
-    def mol2sdf(self, mol, row, verdict):
-        mol.SetProp('_Name', row['Identifier'])
-        mol.SetProp('SMILES', row['SMILES'])
+    def mol2sdf(self, mol, identifier: str, smiles: str, verdict):
+        mol.SetProp('_Name', identifier)
+        mol.SetProp('SMILES', smiles)
         for c in ['HAC', 'HBA', 'HBD', 'Rotatable_Bonds']:
             mol.SetIntProp('HAC', int(verdict[c]))
         for c in ('boringness', 'synthon_score', 'pip_common_mean', 'pip_uncommon_mean', 'combined_Zscore'):
@@ -567,10 +789,88 @@ class CompoundSieve:
         "This is v2 code"
         synthons: List[Chem.Mol] = self.robodecomposer.decompose(mol)
         verdict['N_synthons'] = len(synthons)
+        if self.defer_sociability:
+            # the sociability is calculated for the whole chunk by ``classify_batch``
+            verdict['_synthon_inchis'] = self.defer_sociabilities(synthons)
+            return
         verdict['synthon_sociability'] = sum(
             [self.calc_sociability(synthon) for synthon in synthons])
         verdict['synthon_sociability_per_HAC'] = verdict['synthon_sociability'] / verdict['HAC']
 
+    def defer_sociabilities(self, synthons: List[Chem.Mol]) -> Tuple[InchiType, ...]:
+        """
+        This is v2 code.
+        The synthons not seen before are stored in ``pending_synthons``
+        for ``calc_pending_sociabilities`` to score in one go.
+        """
+        synthon_inchis = tuple(map(Chem.MolToInchi, synthons))
+        for synthon_inchi, synthon in zip(synthon_inchis, synthons):
+            if synthon_inchi not in self.dejavu_synthons and synthon_inchi not in self.nuveau_dejavu_synthons:
+                self.pending_synthons[synthon_inchi] = synthon
+        return synthon_inchis
+
+    def calc_pending_sociabilities(self):
+        """
+        This is v2 code.
+        Batched version of ``calc_sociability`` for the synthons in ``pending_synthons``:
+        the USRCATs are stacked into a single tensor and scored against the common synthons at once
+        as opposed to one GPU call per synthon.
+        """
+        pending_inchis: List[InchiType] = []
+        pending_usrcats: List[List[float]] = []
+        for synthon_inchi, synthon in self.pending_synthons.items():
+            AllChem.EmbedMolecule(synthon)
+            if Chem.Mol.GetNumHeavyAtoms(synthon) < 3 or Chem.Mol.GetNumConformers(synthon) == 0:
+                self.nuveau_dejavu_synthons[synthon_inchi] = -1
+                continue
+            pending_inchis.append(synthon_inchi)
+            pending_usrcats.append(rdMolDescriptors.GetUSRCAT(synthon))
+        self.pending_synthons = {}
+        if not pending_usrcats:
+            return
+        synthon_usrcats = torch.tensor(pending_usrcats, device='cuda')
+        sociabilities = calc_summed_scores_batch(synthon_usrcats, self.common_synthons_usrcats,
+                                                 self.common_synthons_tally).tolist()
+        self.nuveau_dejavu_synthons.update(zip(pending_inchis, sociabilities))
+
+    def classify_batch(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        This is v2 code.
+        Same as ``classify_df``, but the synthon sociabilities are calculated for the whole DataFrame
+        in one batch (see ``calc_pending_sociabilities``) after the per row classification.
+
+        :param df:
+        :return:
+        """
+        assert self.mode == SieveMode.synthon_old, 'Synthon sociability is v2 code (SieveMode.synthon_old)'
+        self.defer_sociability = True
+        try:
+            verdicts: pd.DataFrame = self.classify_df(df)
+        finally:
+            self.defer_sociability = False
+        with rdBase.BlockLogs():
+            self.calc_pending_sociabilities()
+        if '_synthon_inchis' not in verdicts.columns:
+            return verdicts
+        # the rows that passed everything bar the sociability
+        deferred: np.ndarray = (verdicts.acceptable & verdicts._synthon_inchis.notna()).to_numpy()
+        # not ``.get(inchi, default)`` as the default would be looked up even for the previously seen synthons
+        get_sociability = lambda synthon_inchi: self.dejavu_synthons[synthon_inchi] \
+                                                 if synthon_inchi in self.dejavu_synthons \
+                                                 else self.nuveau_dejavu_synthons[synthon_inchi]
+        sociability = np.array([sum(map(get_sociability, synthon_inchis))
+                                for synthon_inchis in verdicts._synthon_inchis.to_numpy()[deferred]])
+        sociability_info = {'synthon_sociability': sociability,
+                            'synthon_sociability_per_HAC': sociability / verdicts.HAC.to_numpy()[deferred]}
+        for key, values in sociability_info.items():
+            verdicts.loc[deferred, key] = values
+        issues: np.ndarray = np.full(len(verdicts), '', dtype=object)
+        issues[deferred] = self.assess_df(sociability_info)
+        verdicts.loc[issues != '', 'acceptable'] = False
+        verdicts.loc[issues != '', 'issue'] = issues[issues != '']
+        print(f'{round(verdicts.acceptable.sum() / len(verdicts) * 100)}% accepted after synthon sociability')
+        return verdicts.drop(columns='_synthon_inchis')
+
     def calc_robogroups(self, mol: Chem.Mol, verdict: dict):
         "This is v2 code"
         # ## Scoring wanted groups
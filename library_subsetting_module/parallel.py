@@ -8,10 +8,16 @@ import sys
 import traceback
 from pathlib import Path
 from types import FunctionType
-from typing import List, Dict, Iterable, Optional
+from typing import List, Dict, Iterable, Optional, BinaryIO, AnyStr, Set
+from concurrent.futures import Future, wait as wait_futures, FIRST_COMPLETED
 from pebble import ProcessPool
 import pandas as pd
 
+try:
+    import indexed_bzip2  # parallel bz2 decompression
+except ImportError:
+    indexed_bzip2 = None
+
 try:
     pd.set_option('future.no_silent_downcasting', True)
 except pd.errors.OptionError:
@@ -23,6 +29,10 @@ class ParallelChunker:
     As the blocks are big and I don't want to clog up /tmp with too many files.
     """
     max_workers = os.cpu_count() - 1
+    # threads used by ``indexed_bzip2`` if installed to decompress the input in the master process
+    decompression_parallelization = max(1, os.cpu_count() // 2)
+    # seconds after which pebble kills a stuck task, which is stored as an error in ``.results``
+    task_timeout: Optional[float] = None
     exceptions_to_catch = (Exception,)
 
     def __init__(self,
@@ -37,33 +47,47 @@ class ParallelChunker:
         :param chunk_size:
         :param task_func:
         """
-        self.futures = []
+        self.futures: Set[Future] = set()
         self.results = []
         self.chunk_size = chunk_size
         self.task_func = task_func
         self.verbose = False
 
+    def collect(self, future: Future):
+        """
+        Store the result of a completed future in ``.results``.
+        """
+        try:
+            self.results.append(future.result())
+        except KeyboardInterrupt as e:
+            raise e
+        except self.exceptions_to_catch as e:
+            tb = '\n'.join(traceback.format_exception(e))
+            if self.verbose:
+                print(f"Task failed but caught: {e.__class__.__name__} {e}\n", tb)
+            self.results.append({'error': f'{e.__class__.__name__} {e}'})
+
     def resolve(self):
-        for future in self.futures:
-            try:
-                self.results.append(future.result())
-            except KeyboardInterrupt as e:
-                raise e
-            except self.exceptions_to_catch as e:
-                tb = '\n'.join(traceback.format_exception(e))
-                if self.verbose:
-                    print(f"Task failed but caught: {e.__class__.__name__} {e}\n", tb)
-                self.results.append({'error': f'{e.__class__.__name__} {e}'})
+        """
+        Wait for all running futures to complete.
+        """
+        done, _ = wait_futures(self.futures)
+        for future in done:
+            self.collect(future)
+        self.futures = set()
 
     def wait(self):
         """
-        Wait for all running futures to complete.
+        Wait until a worker is free, collecting the futures as they complete
+        (as opposed to waiting for the whole batch, which would be held up by the slowest chunk).
+        The results are therefore not in chunk order.
 
         :return:
         """
-        if len(self.futures) >= self.max_workers:
-            self.resolve()
-            self.futures = []
+        while len(self.futures) >= self.max_workers:
+            done, self.futures = wait_futures(self.futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                self.collect(future)
 
     def process_file(self, filename: str,
                      **kwargs):
@@ -77,27 +101,53 @@ class ParallelChunker:
         assert path.exists(), 'file does not exist'
         # process_chunk writes out...
         # ------
+        # ``pool.map`` is not used as pebble schedules the whole iterable upfront,
+        # i.e. the whole file would be read into memory
         with ProcessPool(max_workers=self.max_workers) as pool:
-            with bz2.open(filename, 'rt') as fh:
-                headers = next(fh).strip().split('\t')
-                for i, chunk in enumerate(self.chunked_iterator(fh, self.chunk_size)):
-                    self.wait()
-                    chunk_kwargs = {'chunk': chunk,
-                                    'filename': filename,
-                                    'i': i,
-                                    'headers': headers,
-                                    **kwargs}
-                    future = pool.schedule(self.task_func, kwargs=chunk_kwargs)
-                    self.futures.append(future)
+            for chunk_kwargs in self.chunk_producer(filename, **kwargs):
+                self.wait()
+                future = pool.schedule(self.task_func, kwargs=chunk_kwargs, timeout=self.task_timeout)
+                self.futures.add(future)
         self.resolve()  # wait for all futures to complete as we are done
-        self.futures = []
         df = pd.DataFrame(self.results)
         return df
 
+    def chunk_producer(self, filename: str, **kwargs) -> Iterable[dict]:
+        """
+        Lazily yield the keyword arguments of ``self.task_func`` for each chunk of the file.
+
+        :param filename:
+        :param kwargs: these are passed to self.task_func
+        """
+        with self.open_bz2(filename) as fh:
+            headers = next(fh).decode().strip().split('\t')
+            for i, chunk in enumerate(self.chunked_iterator(fh, self.chunk_size)):
+                yield {'chunk': chunk,
+                       'filename': filename,
+                       'i': i,
+                       'headers': headers,
+                       **kwargs}
+
+    def open_bz2(self, filename: str) -> BinaryIO:
+        """
+        Open a bz2 file for reading in binary mode.
+        The lines are not decoded in the master process, the task does that.
+        Decompression in the master process is the bottleneck as ``bz2`` is single-threaded,
+        so ``indexed_bzip2`` is used if installed.
+        """
+        if indexed_bzip2 is None:
+            return bz2.open(filename, 'rb')
+        return indexed_bzip2.open(filename, parallelization=self.decompression_parallelization)
+
     @staticmethod
-    def chunked_iterator(iterable: Iterable, size: int) -> Iterable:
-        """Yield successive chunks of a specified size from an iterable."""
+    def chunked_iterator(iterable: Iterable[AnyStr], size: int) -> Iterable[AnyStr]:
+        """
+        Yield successive chunks of a specified number of lines from an iterable of lines.
+        Each chunk is a single block (bytes or str, as the lines are) as opposed to a list of lines,
+        because pickling one object to send to the worker is much cheaper than pickling ``size`` objects.
+        """
         iterator = iter(iterable)
         for first in iterator:
-            yield list(itertools.chain([first], itertools.islice(iterator, size - 1)))
+            # ``first[:0]`` is an empty bytes or str matching the lines
+            yield first[:0].join(itertools.chain([first], itertools.islice(iterator, size - 1)))
 
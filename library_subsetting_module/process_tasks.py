@@ -3,48 +3,88 @@ Multiprocessing task, in Pebble at least, cannot be from __main__.
 They need to be imported from a module.
 """
 
-__all__ = ['sieve_chunk', 'test_process_chunk', 'sieve_chunk2']
+__all__ = ['sieve_chunk', 'test_process_chunk', 'sieve_chunk2', 'SIEVE_CHUNK_HEADERS', 'SIEVE_CHUNK2_HEADERS']
 
 from . import CompoundSieve, SieveMode, DatasetConverter, write_jsonl
-from typing import List, Optional
+from typing import List, Optional, Union
 import bz2
+import os
 from pathlib import Path
 import contextlib
+import numpy as np
 import pandas as pd
 
-def sieve_chunk(chunk: List[str],
+# the columns written by ``sieve_chunk`` and ``sieve_chunk2`` respectively,
+# also the headers of the combined files (see ``concatenate_bz2``)
+SIEVE_CHUNK_HEADERS = ['SMILES', 'Identifier', 'HAC', 'HBA', 'HBD', 'Rotatable_Bonds',
+                       'synthon_sociability', 'N_synthons', 'synthon_score', 'boringness']
+SIEVE_CHUNK2_HEADERS = ['SMILES', 'Identifier', 'HAC', 'HBA', 'HBD', 'Rotatable_Bonds', 'boringness', 'synthon_score',
+                        'pip_common_mean', 'pip_uncommon_mean', 'combined_Zscore']
+
+@contextlib.contextmanager
+def open_bz2_atomically(filename: str):
+    """
+    Opens ``filename + '.part'`` for writing (bz2 text), which is renamed to ``filename`` once closed.
+    A worker killed mid-write (e.g. ``ParallelChunker.task_timeout``) therefore does not leave a truncated
+    ``filename`` for ``concatenate_bz2`` to combine.
+    """
+    part_filename = f'{filename}.part'
+    with bz2.open(part_filename, 'wt') as fh:
+        yield fh
+    os.replace(part_filename, filename)
+
+def read_chunk(chunk: Union[bytes, str, List[str]]) -> pd.DataFrame:
+    """
+    Reads a chunk from ``ParallelChunker.chunked_iterator`` (a block of lines as bytes)
+    or a list of lines as before.
+    """
+    if isinstance(chunk, bytes):
+        content = chunk.decode()
+    elif isinstance(chunk, str):
+        content = chunk
+    else:
+        content = '\n'.join(chunk)
+    # header_info is based off headers, but modified a bit
+    return DatasetConverter.read_cxsmiles_block(content, header_info=DatasetConverter.enamine_header_info)
+
+def sieve_chunk(chunk: Union[bytes, List[str]],
                        filename: str,
                        i: int,
                        summary_cache:str,
                        out_filename_template: str,
                        mode:SieveMode=SieveMode.basic,
+                       write_header: bool=True,
+                       smiles_parser_threads: int=0,
+                       row_threads: int=1,
                        **kwargs):
     """
     The chunk is processed and saved to disk.
 
-    :param chunk: the list of lines (str) to process
+    :param chunk: the block of lines (bytes) to process
     :param filename: the original filename (for record keeping)
     :param i: chunk index (for record keeping and for ``filename_template.format(i=i)``)
     :param summary_cache:
     :param out_filename_template: out filename with {i} placeholder
     :param mode: ``SieveMode.basic``, ``SieveMode.substructure`` or ``SieveMode.synthon``
+    :param write_header: False if the chunks are to be combined with ``concatenate_bz2``
+    :param smiles_parser_threads: see ``CompoundSieve.smiles_parser_threads`` (0 = parse per row)
+    :param row_threads: see ``CompoundSieve.row_threads`` (1 = no thread pool)
     :param kwargs: ParallelChunker may pass arguments that are not needed.
     :return:
     """
     output_file = out_filename_template.format(i=i)
     classifier = CompoundSieve(mode=mode)
-    # header_info is based off headers, but modified a bit
-    df = DatasetConverter.read_cxsmiles_block('\n'.join(chunk), header_info=DatasetConverter.enamine_header_info)
+    classifier.smiles_parser_threads = smiles_parser_threads
+    classifier.row_threads = row_threads
+    df = read_chunk(chunk)
     # ## Process the chunk
     verdicts = classifier.classify_df(df)
     Path(output_file).parent.mkdir(exist_ok=True, parents=True)
     if sum(verdicts.acceptable):
-        cols = ['SMILES', 'Identifier', 'HAC', 'HBA', 'HBD', 'Rotatable_Bonds', 'synthon_sociability', 'N_synthons', 'synthon_score', 'boringness']
-        txt = '\t'.join(map(str, cols)) + '\n'
-        for idx, row in df.loc[verdicts.acceptable].iterrows():
-            txt += '\t'.join([str(row.get(k, 0.)) for k in cols]) + '\n'
-        with bz2.open(output_file, 'wt') as fh:
-            fh.write(txt)
+        # streamed to the file as opposed to building a string: columns missing in df are written as 0.
+        with open_bz2_atomically(output_file) as fh:
+            df.loc[verdicts.acceptable].reindex(columns=SIEVE_CHUNK_HEADERS, fill_value=0.)\
+              .to_csv(fh, sep='\t', header=write_header, index=False, lineterminator='\n')
     else:
         print(f"No compounds selected in {filename} chunk {i}", flush=True)
     # ## wrap up
@@ -53,60 +93,60 @@ def sieve_chunk(chunk: List[str],
     write_jsonl(info, summary_cache)
     return info
 
-def sieve_chunk2(chunk: List[str],
+def sieve_chunk2(chunk: Union[bytes, List[str]],
                    filename: str,
                    i: int,
                    summary_cache:str,
                    out_filename_template: str,
                    store_sdf: bool=False,
+                   write_header: bool=True,
+                   smiles_parser_threads: int=0,
+                   row_threads: int=1,
                    **kwargs):
     """
     The chunk is processed and saved to disk.
 
-    :param chunk: the list of lines (str) to process
+    :param chunk: the block of lines (bytes) to process
     :param filename: the original filename (for record keeping)
     :param i: chunk index (for record keeping and for ``filename_template.format(i=i)``)
     :param summary_cache:
     :param out_filename_template: out filename with {i} and {tier} placeholder
+    :param write_header: False if the chunks are to be combined with ``concatenate_bz2``
+    :param smiles_parser_threads: see ``CompoundSieve.smiles_parser_threads`` (0 = parse per row)
+    :param row_threads: see ``CompoundSieve.row_threads`` (1 = no thread pool)
     :param kwargs: ParallelChunker may pass arguments that are not needed.
     :return:
     """
     output_files = {tier: out_filename_template.format(i=i, tier=tier) for tier in ['Zn2-n1', 'Zn1-n05', 'Zn05-0', 'Z0-05', 'Z05-08', 'Z08-1', 'Z1']}
+    # lower bounds of the tiers above
+    tier_edges = [-2., -1., -0.5, 0., 0.5, 0.8, 1.]
     classifier = CompoundSieve(mode=SieveMode.synthon, use_row_info=False, store_sdf=store_sdf)
+    classifier.smiles_parser_threads = smiles_parser_threads
+    classifier.row_threads = row_threads
     #classifier.cutoffs = {'max_HAC': 35}  # this was not causing any issues.
-    # header_info is based off headers, but modified a bit
-    df: pd.DataFrame = DatasetConverter.read_cxsmiles_block('\n'.join(chunk), header_info=DatasetConverter.enamine_header_info)
+    df: pd.DataFrame = read_chunk(chunk)
     # ## Process the chunk
     verdicts: pd.DataFrame = classifier.classify_df(df)
-    headers = ['SMILES', 'Identifier', 'HAC', 'HBA', 'HBD', 'Rotatable_Bonds', 'boringness', 'synthon_score',
-               'pip_common_mean', 'pip_uncommon_mean', 'combined_Zscore']
     Path(out_filename_template).parent.mkdir(exist_ok=True, parents=True)
     if sum(verdicts.acceptable):
-        masks = {'Zn2-n1': (verdicts.combined_Zscore >= -2.) & (verdicts.combined_Zscore < -1),
-                'Zn1-n05': (verdicts.combined_Zscore >= -1.) & (verdicts.combined_Zscore < -0.5),
-                 'Zn05-0': (verdicts.combined_Zscore >= -0.5) & (verdicts.combined_Zscore < 0.),
-                 'Z0-05': (verdicts.combined_Zscore >= 0.) & (verdicts.combined_Zscore < 0.5),
-                 'Z05-08': (verdicts.combined_Zscore >= 0.5) & (verdicts.combined_Zscore < 0.8),
-                  'Z08-1': (verdicts.combined_Zscore >= 0.8) & (verdicts.combined_Zscore < 1.),
-                  'Z1': (verdicts.combined_Zscore >= 1.)
-                 }
-        for tier, mask in masks.items():
-            with bz2.open(output_files[tier], 'wt') as fh:
-                # value_col = sdfblock or cxsmiles_line
-                if not store_sdf:
-                    fh.write('\t'.join(headers) + '\n')
+        ranked: pd.DataFrame = verdicts.sort_values('combined_Zscore', ascending=False).drop_duplicates('SMILES')
+        acceptables: np.ndarray = ranked.acceptable.to_numpy(dtype=bool)
+        # tier 0 is below -2 or NaN, i.e. not written
+        zscores: np.ndarray = ranked.combined_Zscore.to_numpy(dtype=float)
+        tier_idxs: np.ndarray = np.where(np.isnan(zscores), 0, np.digitize(zscores, tier_edges))
+        for j, tier in enumerate(output_files, start=1):
+            selected: pd.DataFrame = ranked.loc[acceptables & (tier_idxs == j)]
+            with open_bz2_atomically(output_files[tier]) as fh:
                 try:
-                    for verdict_idx, row in verdicts.sort_values('combined_Zscore', ascending=False)\
-                                           .drop_duplicates('SMILES') \
-                                           .loc[verdicts.acceptable & mask]\
-                                           .iterrows():
-                        if not store_sdf:
-                            parts = [str(row.get(k, default=''))  for k in headers]
-                            fh.write('\t'.join(parts) + '\n')
-                        elif 'sdfblock' in row.index and isinstance(row.sdfblock, str):
-                            fh.write(row.sdfblock) # the $$$$\n is already in the sdfblock end
-                        else:
-                            pass  # this really ought to be an error...
+                    if not store_sdf:
+                        # missing columns are blank, NaN are written as nan
+                        selected.reindex(columns=SIEVE_CHUNK2_HEADERS, fill_value='')\
+                                .to_csv(fh, sep='\t', header=write_header, index=False, na_rep='nan', lineterminator='\n')
+                    elif 'sdfblock' in selected.columns:
+                        # the $$$$\n is already in the sdfblock end
+                        fh.writelines([block for block in selected.sdfblock.to_numpy() if isinstance(block, str)])
+                    else:
+                        pass  # this really ought to be an error...
                 except KeyboardInterrupt as error:
                     raise error
                 except Exception as error:
@@ -124,4 +164,5 @@ def sieve_chunk2(chunk: List[str],
     return info
 
 def test_process_chunk(chunk, *args, **kwargs):
-    return f"Test: received {len(chunk)} lines ({args}, {kwargs})"
+    n_lines = chunk.count(b'\n') if isinstance(chunk, bytes) else len(chunk)
+    return f"Test: received {n_lines} lines ({args}, {kwargs})"
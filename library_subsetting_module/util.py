@@ -1,8 +1,9 @@
 import pandas as pd
 import numpy as np
 from scipy.stats import skewnorm, norm
-import json, os
-from typing import Any, NewType
+import json, os, bz2, shutil
+from pathlib import Path
+from typing import Any, NewType, Iterable, Optional
 
 InchiType = NewType('InchiType', str)
 
@@ -22,6 +23,22 @@ def read_jsonl(filename: str) -> Any:
                 pass  # burnt line
         return data
 
+def concatenate_bz2(in_paths: Iterable[Path], out_filename: str, header: Optional[str]=None) -> None:
+    """
+    Combines bz2 files byte-wise, without decompressing and recompressing them,
+    as a concatenation of bz2 streams is a valid bz2 file.
+    Therefore the input files should lack a header line (see ``write_header`` argument of the sieve tasks),
+    the ``header`` (no newline needed) is written as its own stream at the start.
+    The files are not checked: the sieve tasks write to a ``.part`` file that is renamed when complete
+    (see ``process_tasks.open_bz2_atomically``), so a truncated chunk does not match ``*.bz2``.
+    """
+    with open(out_filename, 'wb') as out_fh:
+        if header is not None:
+            out_fh.write(bz2.compress((header.rstrip('\n') + '\n').encode()))
+        for in_path in in_paths:
+            with open(in_path, 'rb') as in_fh:
+                shutil.copyfileobj(in_fh, out_fh)
+
 def get_skewnorm_params(series: pd.Series, remove_zeros=False) -> dict:
     mask = ~series.isna()
     if remove_zeros: